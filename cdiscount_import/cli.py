@@ -8,9 +8,14 @@ import openpyxl
 import re
 import os
 import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from openpyxl.utils.dataframe import dataframe_to_rows
 from loguru import logger
 import json
+from typing import Iterable
+import sqlite3
 import plenty_api
 
 
@@ -29,6 +34,7 @@ if not CONFIG_FOLDER.exists():
     pathlib.Path(CONFIG_FOLDER).mkdir(parents=True, exist_ok=True)
 
 CONFIG_PATH = CONFIG_FOLDER / 'config.ini'
+INDEX_PATH = CONFIG_FOLDER / 'uniqueness_index.db'
 
 if not CONFIG_PATH.exists():
     open(CONFIG_PATH, 'a').close()
@@ -45,6 +51,18 @@ MAX_PARENT_SKU_LEN = 50
 MAX_EAN_LEN = 13
 MAX_MARKET_COLOR_LEN = 50
 ID_INDEX = 0
+BARCODE_INDEX = 1
+# Position of the `Family sku` column after the texts have been added
+FAMILY_SKU_INDEX = 9
+# Minimum length of a row after get_texts() inserted the 4 text columns
+TEXT_ROW_LEN = 13
+DEFAULT_MAX_WORKERS = 4
+# Remaining calls of the short period, at which the workers start to wait
+MIN_CALLS_LEFT = 2
+MIN_RETRY_DELAY = 1
+MAX_RETRIES = 5
+# Seconds to wait for the connection and for each response of the REST API
+REQUEST_TIMEOUT = 60
 
 
 cdiscount_list = [
@@ -93,9 +111,273 @@ class InvalidConfig(Exception):
         return f"missing option `{self.option}` in section [{self.section}]"
 
 
+def is_valid_ean13(code: str) -> bool:
+    """
+    Validate the check digit of an EAN-13 (GTIN-13) barcode.
+
+    Parameters:
+        code            [str]   -   13 digit barcode
+
+    Return:
+                        [bool]
+    """
+    if len(code) != MAX_EAN_LEN or not code.isdigit():
+        return False
+    digits = [int(digit) for digit in code]
+    total = sum(digits[:-1:2]) + 3 * sum(digits[1:-1:2])
+    return (10 - total % 10) % 10 == digits[-1]
+
+
+class UniquenessIndex:
+    """
+    Persistent index of the exported barcodes and parent SKUs.
+
+    The index is stored in a SQLite database, which allows to detect barcodes
+    and parent SKUs that collide with previous exports before the upload to
+    Cdiscount. The current run is the source of truth: every variation of
+    the run is staged before the checks, an entry of a seller reference
+    (or item) that has another barcode (or parent SKU) in the current run is
+    ignored. After the export, the entries of every exported seller
+    reference and its item are replaced by the current values.
+    Entries of deleted variations are never replaced, they can be removed
+    with the `--release` option or all at once with `--reset-index`.
+
+    Attributes:
+            path        -   Location of the SQLite database
+            barcodes    -   Barcodes of the current run with their first
+                            seller ref
+            parents     -   Parent SKUs of the current run with their first
+                            item ID
+            items       -   Parent SKU of every item in the current run
+            staged      -   Values of the current run for every seller ref
+    """
+    def __init__(self, path: pathlib.Path = INDEX_PATH) -> None:
+        self.path = path
+        self.barcodes = {}
+        self.parents = {}
+        self.items = {}
+        self.staged = {}
+        self.connection = sqlite3.connect(str(path))
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS barcodes (
+                barcode TEXT PRIMARY KEY,
+                seller_ref TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS parents (
+                parent_sku TEXT PRIMARY KEY,
+                item_id TEXT NOT NULL
+            );
+        """)
+
+    def __lookup(self, query: str, value: str) -> str:
+        """Get the first column of the first matching row or ''."""
+        row = self.connection.execute(query, (value,)).fetchone()
+        return row[0] if row else ''
+
+    def barcode_owner(self, barcode: str) -> str:
+        """
+        Get the seller reference that uses the barcode.
+
+        The previous owner keeps the barcode, unless the current run assigns
+        another barcode to it.
+        """
+        owner = self.__lookup(
+            'SELECT seller_ref FROM barcodes WHERE barcode = ?', barcode)
+        if owner and owner in self.staged and \
+                self.staged[owner][0] != barcode:
+            owner = ''
+        return owner or self.barcodes.get(barcode, '')
+
+    def parent_owner(self, parent_sku: str) -> str:
+        """
+        Get the ID of the item that uses the parent SKU.
+
+        The previous item keeps the parent SKU, unless the current run
+        assigns another parent SKU to it.
+        """
+        owner = self.__lookup(
+            'SELECT item_id FROM parents WHERE parent_sku = ?', parent_sku)
+        if owner and owner in self.items and self.items[owner] != parent_sku:
+            owner = ''
+        return owner or self.parents.get(parent_sku, '')
+
+    def check(self, barcode: str, seller_ref: str, parent_sku: str,
+              item_id: str) -> tuple:
+        """
+        Compare a variation with the current run and the previous exports.
+
+        Parameters:
+            barcode     [str]   -   EAN-13 barcode of the variation
+            seller_ref  [str]   -   Seller reference of the variation
+            parent_sku  [str]   -   SKU of the parent variation
+            item_id     [str]   -   ID of the item
+
+        Return:
+                        [tuple] -   barcode and parent SKU, colliding values
+                                    are replaced by an error message
+        """
+        owner = self.barcode_owner(barcode=barcode)
+        if owner and owner != seller_ref:
+            barcode = f'Barcode used by {owner}'
+
+        owner = self.parent_owner(parent_sku=parent_sku)
+        if owner and owner != item_id:
+            parent_sku = f'Parent SKU used by item {owner}'
+
+        return (barcode, parent_sku)
+
+    def stage(self, barcode: str, seller_ref: str, parent_sku: str,
+              item_id: str) -> None:
+        """
+        Record the values of a variation of the current run.
+
+        All variations of the run have to be staged before the first check.
+
+        Parameters:
+            barcode     [str]   -   EAN-13 barcode of the variation
+            seller_ref  [str]   -   Seller reference of the variation
+            parent_sku  [str]   -   SKU of the parent variation
+            item_id     [str]   -   ID of the item
+        """
+        self.barcodes.setdefault(barcode, seller_ref)
+        self.parents.setdefault(parent_sku, item_id)
+        self.items[item_id] = parent_sku
+        self.staged[seller_ref] = (barcode, parent_sku, item_id)
+
+    def update(self, seller_refs: Iterable[str]) -> None:
+        """
+        Replace the entries of the exported seller references.
+
+        Parameters:
+            seller_refs [iterable] - Seller references written to the
+                                    Cdiscount file
+        """
+        with self.connection:
+            for seller_ref in seller_refs:
+                try:
+                    barcode, parent_sku, item_id = self.staged[seller_ref]
+                except KeyError:
+                    continue
+                self.connection.execute(
+                    'DELETE FROM barcodes WHERE seller_ref = ?',
+                    (seller_ref,))
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO barcodes VALUES (?, ?)',
+                    (barcode, seller_ref))
+                self.connection.execute(
+                    'DELETE FROM parents WHERE item_id = ? AND '
+                    'parent_sku != ?', (item_id, parent_sku))
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO parents VALUES (?, ?)',
+                    (parent_sku, item_id))
+
+    def release(self, value: str) -> int:
+        """
+        Remove the entries of a barcode, seller reference or parent SKU.
+
+        Parameters:
+            value       [str]   -   Barcode, seller reference or parent SKU
+
+        Return:
+                        [int]   -   Amount of removed entries
+        """
+        with self.connection:
+            removed = self.connection.execute(
+                'DELETE FROM barcodes WHERE barcode = ? OR seller_ref = ?',
+                (value, value)).rowcount
+            removed += self.connection.execute(
+                'DELETE FROM parents WHERE parent_sku = ?', (value,)).rowcount
+        return removed
+
+    def reset(self) -> None:
+        """Remove all entries from the index."""
+        with self.connection:
+            self.connection.execute('DELETE FROM barcodes')
+            self.connection.execute('DELETE FROM parents')
+
+    def close(self) -> None:
+        """Close the connection to the database."""
+        self.connection.close()
+
+
+class RateLimiter:
+    """
+    Share the Plentymarkets API call limit between multiple threads.
+
+    Plentymarkets reports the remaining calls of the current short period
+    and the seconds until that period decays within the response headers.
+    When the remaining calls are depleted, every thread waits until the
+    period has decayed.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.resume_at = 0.0
+
+    def wait(self) -> None:
+        """Block the calling thread until new requests are allowed."""
+        with self.lock:
+            delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stop all threads from sending requests for a while.
+
+        Parameters:
+            seconds     [float] -   Duration of the pause
+        """
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    def update(self, response: requests.Response, attempt: int = 0) -> None:
+        """
+        Read the rate limit headers of a response.
+
+        A rejected request (429) pauses for at least `MIN_RETRY_DELAY`
+        seconds, doubled with every further attempt.
+
+        Parameters:
+            response    [Response]  -   Response of the Plentymarkets API
+            attempt     [int]       -   Number of previous attempts for the
+                                        same request
+        """
+        headers = response.headers
+        try:
+            calls_left = int(
+                headers['X-Plenty-Global-Short-Period-Calls-Left'])
+            decay = int(headers['X-Plenty-Global-Short-Period-Decay'])
+        except (KeyError, ValueError):
+            calls_left, decay = 0, 0
+
+        if response.status_code == 429:
+            self.pause(seconds=max(decay, MIN_RETRY_DELAY) * 2 ** attempt)
+        elif calls_left <= MIN_CALLS_LEFT and decay > 0:
+            self.pause(seconds=decay)
+
+
+def split_pages(last_page: int, shards: int) -> list:
+    """
+    Split the pages after the first page into consecutive ranges.
+
+    Parameters:
+        last_page       [int]   -   Number of the last page
+        shards          [int]   -   Maximum amount of ranges
+
+    Return:
+                        [list]  -   List of non-empty ranges in page order
+    """
+    pages = range(2, last_page + 1)
+    if not pages:
+        return []
+    shards = max(1, min(shards, len(pages)))
+    size = -(-len(pages) // shards)
+    return [pages[i:i + size] for i in range(0, len(pages), size)]
+
+
 class PlentyFetch:
     def __init__(self, config: configparser.ConfigParser,
-                 debug: bool = False) -> None:
+                 debug: bool = False, index: UniquenessIndex = None) -> None:
         self.config = config
         self.__check_config()
         self.debug = debug
@@ -105,6 +387,7 @@ class PlentyFetch:
         self.variations = []
         self.item_ids = {}
         self.errors = []
+        self.index = index
 
     def __check_config(self):
         """
@@ -197,6 +480,160 @@ class PlentyFetch:
 
         return mapping
 
+    def __get_variation_page(self, query: dict, page: int,
+                             limiter: RateLimiter) -> dict:
+        """
+        Fetch a single page of variations while respecting the rate limit.
+
+        Parameters:
+            query       [dict]  -   Query parameters of the request
+            page        [int]   -   Number of the page to fetch
+            limiter [RateLimiter] - Rate limit shared between all workers
+
+        Return:
+                        [dict]  -   JSON response of the REST API
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            limiter.wait()
+            try:
+                response = requests.get(
+                    self.api.url + '/rest/items/variations',
+                    headers=self.api.creds, params={**query, 'page': page},
+                    timeout=REQUEST_TIMEOUT
+                )
+            except requests.RequestException as err:
+                logger.error(f"Request for variation page {page} failed: "
+                             f"{err}")
+                raise RuntimeError(
+                    f"Unable to fetch variation page {page}") from err
+
+            limiter.update(response=response, attempt=attempt)
+            if response.status_code == 429:
+                logger.warning(f"Rate limit reached at variation page {page} "
+                               f"(attempt {attempt + 1}/{MAX_RETRIES + 1})")
+                continue
+            if not response.ok:
+                logger.error(f"Variation page {page} failed with status "
+                             f"{response.status_code}: {response.text}")
+                raise RuntimeError(
+                    f"Unable to fetch variation page {page}")
+            return response.json()
+
+        raise RuntimeError(f"Rate limit exceeded for variation page {page} "
+                           f"after {MAX_RETRIES} retries")
+
+    def __get_variation_shard(self, query: dict, pages: range,
+                              limiter: RateLimiter,
+                              failed: threading.Event) -> list:
+        """
+        Fetch a consecutive range of variation pages.
+
+        The shard stops early, once another shard has failed.
+
+        Parameters:
+            query       [dict]  -   Query parameters of the request
+            pages       [range] -   Page numbers that belong to the shard
+            limiter [RateLimiter] - Rate limit shared between all workers
+            failed      [Event] -   Set as soon as any shard has failed
+
+        Return:
+                        [list]  -   Variations of all pages in page order
+        """
+        entries = []
+        for page in pages:
+            if failed.is_set():
+                return []
+            try:
+                entries += self.__get_variation_page(
+                    query=query, page=page, limiter=limiter)['entries']
+            except Exception:
+                failed.set()
+                raise
+        logger.debug(f"Fetched variation pages {pages.start}-{pages.stop - 1}")
+        return entries
+
+    def __get_variations_sharded(self, refine: dict, additional: list,
+                                 lang: str, shards: int,
+                                 workers: int) -> list:
+        """
+        Download the variations with multiple concurrent workers.
+
+        The first page reveals the total amount of pages, the remaining
+        pages are split into consecutive ranges (shards), which are
+        downloaded in parallel. The shards are joined in page order, so the
+        result is identical to a sequential download.
+
+        Parameters:
+            refine      [dict]  -   Filters for the variations
+            additional  [list]  -   Additional data blocks to fetch
+            lang        [str]   -   2 letter abbr. of the target language
+            shards      [int]   -   Amount of page ranges
+            workers     [int]   -   Maximum amount of concurrent downloads
+
+        Return:
+                        [list]
+        """
+        limiter = RateLimiter()
+        query = {**refine, 'with': ','.join(additional), 'lang': lang}
+        first_page = self.__get_variation_page(
+            query=query, page=1, limiter=limiter)
+        last_page = int(first_page['lastPageNumber'])
+        ranges = split_pages(last_page=last_page, shards=shards)
+
+        logger.debug(f"Get {last_page} variation pages in {len(ranges)} "
+                     f"shards with {workers} workers")
+        failed = threading.Event()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(self.__get_variation_shard, query=query,
+                                pages=pages, limiter=limiter, failed=failed)
+                for pages in ranges
+            ]
+            variations = list(first_page['entries'])
+            try:
+                for future in futures:
+                    variations += future.result()
+            except Exception:
+                failed.set()
+                for future in futures:
+                    future.cancel()
+                raise
+
+        return variations
+
+    def __get_variations(self, refine: dict, additional: list,
+                         lang: str) -> list:
+        """
+        Get the variations either sequentially or in parallel shards.
+
+        The sharded download is activated with the option `variation_shards`
+        in the [plenty] section, `variation_workers` limits the amount of
+        concurrent downloads.
+        Unlike the plenty_api download, the sharded download requests the
+        REST API directly: it shows no progress bar (the finished shards are
+        logged instead) and raises a RuntimeError when a page cannot be
+        fetched, or is still rate limited after `MAX_RETRIES` retries.
+
+        Parameters:
+            refine      [dict]  -   Filters for the variations
+            additional  [list]  -   Additional data blocks to fetch
+            lang        [str]   -   2 letter abbr. of the target language
+
+        Return:
+                        [list]
+        """
+        shards = self.config.getint('plenty', 'variation_shards', fallback=1)
+        if shards <= 1:
+            return self.api.plenty_api_get_variations(
+                refine=refine, additional=additional, lang=lang)
+
+        workers = self.config.getint(
+            'plenty', 'variation_workers',
+            fallback=min(shards, DEFAULT_MAX_WORKERS))
+        return self.__get_variations_sharded(
+            refine=refine, additional=additional, lang=lang,
+            shards=shards, workers=max(1, workers))
+
     def __get_color_attribute(self, variation: dict) -> str:
         """
         Get the markting color from the color mapping table for a color.
@@ -306,6 +743,8 @@ class PlentyFetch:
             if barcode['barcodeId'] == barcode_id:
                 if len(barcode['code']) != MAX_EAN_LEN:
                     return 'Invalid EAN barcode length'
+                if not is_valid_ean13(code=barcode['code']):
+                    return 'Invalid EAN barcode checksum'
                 return barcode['code']
 
         return 'No EAN barcode found'
@@ -409,15 +848,38 @@ class PlentyFetch:
 
         return [x['url'] for x in image_list]
 
+    def __stage_variations(self, variations: list) -> None:
+        """
+        Stage the barcode and parent SKU of every variation in the index.
+
+        Parameters:
+            variations  [list]  -   JSON of all variations from the
+                                    Plentymarkets REST API
+        """
+        for variation in variations:
+            if variation['isMain']:
+                continue
+            try:
+                parent_sku = variation['parent']['number']
+            except (KeyError, IndexError, TypeError):
+                parent_sku = ''
+            self.index.stage(
+                barcode=self.__get_barcode(variation=variation),
+                seller_ref=str(variation['id']), parent_sku=parent_sku,
+                item_id=str(variation['itemId']))
+
     def extract_data(self):
         """
         Get all the variations from the API that have the referrerId of
         cdiscount.  Then cycle through the json file for the data that is
         needed and do checks if they fulfill cdiscounts requirements and put
         them into a list of lists.
+
+        When a uniqueness index is given, all variations are staged first,
+        then the barcodes and parent SKUs are checked against the index.
         """
         self.attribute_mapping = self.__get_attribute_mappings(lang='fr')
-        variations = self.api.plenty_api_get_variations(
+        variations = self.__get_variations(
             refine = {'referrerId': self.referrer_id}, additional = [
                 'variationProperties', 'variationBarcodes',
                 'variationDefaultCategory', 'images',
@@ -425,6 +887,8 @@ class PlentyFetch:
             ],
             lang='fr'
         )
+        if self.index:
+            self.__stage_variations(variations=variations)
 
         image_block = []
         img = False
@@ -453,7 +917,8 @@ class PlentyFetch:
 
             barcode = self.__get_barcode(variation=variation)
             if barcode in ['No barcode found', 'No EAN barcode found',
-                           'Invalid EAN barcode length']:
+                           'Invalid EAN barcode length',
+                           'Invalid EAN barcode checksum']:
                 err = True
 
             try:
@@ -491,6 +956,14 @@ class PlentyFetch:
                                'No mapped cdiscount category']:
                 err = True
 
+            if self.index and not err:
+                checked = self.index.check(
+                    barcode=barcode, seller_ref=seller_ref,
+                    parent_sku=parent_sku, item_id=str(variation['itemId']))
+                if checked != (barcode, parent_sku):
+                    err = True
+                    (barcode, parent_sku) = checked
+
             product_nature = 'Variant'
 
             image_block = self.__get_images(variation=variation)
@@ -602,6 +1075,91 @@ class PlentyFetch:
                     variation.insert(12, text['long_description'])
 
 
+class FamilySorter:
+    """
+    Group the variations by parent SKU and remove duplicates.
+
+    The first variation of the extraction keeps a barcode, further variations
+    with the same barcode are moved to the errors, repeated seller references
+    are dropped. Rows without texts have no `Family sku` column at
+    `FAMILY_SKU_INDEX` and are moved to the errors as well.
+    The rows are sorted in memory, as PlentyFetch holds the whole catalogue
+    anyway.
+
+    The sorter is enabled with the option `sort_by_family` in the [general]
+    section. When PlentyFetch runs with a UniquenessIndex (as in `main`),
+    duplicate barcodes of the run are already moved to the errors during
+    `extract_data`, the barcode check of the sorter only applies to
+    variations extracted without an index.
+
+    Attributes:
+            errors      -   Removed rows in the column order of the error file
+    """
+    def __init__(self) -> None:
+        self.errors = []
+
+    @staticmethod
+    def __seller_ref_key(seller_ref: str) -> tuple:
+        """Order numeric seller references (variation IDs) by their value."""
+        seller_ref = str(seller_ref)
+        if seller_ref.isdigit():
+            return (0, int(seller_ref), '')
+        return (1, 0, seller_ref)
+
+    @staticmethod
+    def __error_row(row: list) -> list:
+        """
+        Convert a row with texts into the column order of the error file.
+
+        Parameters:
+            row         [list]  -   Variation in the order of the Cdiscount
+                                    file
+
+        Return:
+                        [list]
+        """
+        images = (row[13:16] + [''] * 3)[:3]
+        return row[0:5] + row[8:12] + images + row[5:8] + [row[12]]
+
+    def sort(self, variations: Iterable[list]) -> list:
+        """
+        Group the variations by the parent SKU without duplicates.
+
+        Parameters:
+            variations [iterable] - Variations with texts in the order of the
+                                    Cdiscount file
+
+        Return:
+                        [list]  -   Variations sorted by parent SKU and
+                                    seller reference
+        """
+        barcodes = {}
+        seller_refs = set()
+        unique = []
+        for row in variations:
+            if len(row) < TEXT_ROW_LEN:
+                logger.warning(f"No texts found for {row[ID_INDEX]}")
+                # Without texts the row already matches the error file
+                self.errors.append(row)
+                continue
+            if row[ID_INDEX] in seller_refs:
+                continue
+            if row[BARCODE_INDEX] in barcodes:
+                logger.warning(
+                    f"Duplicate barcode {row[BARCODE_INDEX]} for "
+                    f"{row[ID_INDEX]} (used by {barcodes[row[BARCODE_INDEX]]})")
+                self.errors.append(self.__error_row(row=row))
+                continue
+            barcodes[row[BARCODE_INDEX]] = row[ID_INDEX]
+            seller_refs.add(row[ID_INDEX])
+            unique.append(row)
+
+        return sorted(unique, key=lambda row: (
+            str(row[FAMILY_SKU_INDEX]),
+            self.__seller_ref_key(seller_ref=row[ID_INDEX])
+        ))
+
+
 class CdiscountWriter:
     def __init__(self, filename: str, error_filename: str,
                  base_path: str = ''):
@@ -613,17 +1171,18 @@ class CdiscountWriter:
         self.filename = base_path / filename
         self.error_filename = base_path / error_filename
 
-    def write_xlsx(self, variations: list):
+    def write_xlsx(self, variations: Iterable[list]):
         """
-        Put the extracted data into a dataframe and write into an excel file.
+        Write the extracted data into an excel file.
 
         Parameters:
-            variations  [list]  -   Extracted variations from the plentymarkets
+            variations [iterable] - Extracted variations from the plentymarkets
                                     API in the correct order for the Cdiscount
                                     file
         """
-        df = pd.DataFrame(variations)
-        if len(df.index) == 0:
+        rows = iter(variations)
+        first_row = next(rows, None)
+        if first_row is None:
             logger.warning("No extracted variations found.")
             return
 
@@ -635,7 +1194,8 @@ class CdiscountWriter:
         ws.append(['',''])
         ws.append(cdiscount_list)
         ws.append(['',''])
-        for row in dataframe_to_rows(df, index = False, header = False):
+        ws.append(first_row)
+        for row in rows:
             ws.append(row)
 
         wb.save(filename=self.filename)
@@ -676,6 +1236,14 @@ def main():
     parser.add_argument('--debug', '-d', required=False,
                         help='Activate debugging output',
                         dest='debug', action='store_true')
+    parser.add_argument('--release', required=False, action='append',
+                        help='Remove a barcode, seller ref or parent SKU '
+                        'from the uniqueness index and exit (repeatable)',
+                        dest='release', default=[], metavar='VALUE')
+    parser.add_argument('--reset-index', required=False,
+                        help='Remove all entries from the uniqueness index '
+                        'and exit',
+                        dest='reset_index', action='store_true')
     args = parser.parse_args()
 
     config = configparser.ConfigParser()
@@ -688,22 +1256,45 @@ def main():
         logger.add(sys.stdout, filter='cdiscount_import.cli', level="INFO")
 
     base_path = ''
+    sort_by_family = False
     if config.has_section(section='general'):
         if config.has_option(section='general', option='file_destination'):
             base_path = config['general']['file_destination']
+        sort_by_family = config.getboolean(
+            'general', 'sort_by_family', fallback=False)
 
+    index = UniquenessIndex()
     try:
-        plenty_fetch = PlentyFetch(config=config, debug=args.debug)
-    except InvalidConfig as err:
-        logger.error(f"Configuration error: {err}")
-        sys.exit(1)
-
-    cdiscount_writer = CdiscountWriter(filename='cdiscount_import.xlsm',
-                                       error_filename='cdiscount_errors.xlsm',
-                                       base_path=base_path)
-
-    plenty_fetch.connect()
-    plenty_fetch.extract_data()
-    plenty_fetch.get_texts()
-    cdiscount_writer.write_xlsx(variations=plenty_fetch.variations)
-    cdiscount_writer.write_error(errors=plenty_fetch.errors)
+        if args.reset_index:
+            index.reset()
+            logger.info("Removed all entries from the uniqueness index")
+        for value in args.release:
+            removed = index.release(value=value)
+            logger.info(f"Released {removed} index entries for {value}")
+        if args.reset_index or args.release:
+            return
+
+        try:
+            plenty_fetch = PlentyFetch(config=config, debug=args.debug,
+                                       index=index)
+        except InvalidConfig as err:
+            logger.error(f"Configuration error: {err}")
+            sys.exit(1)
+
+        cdiscount_writer = CdiscountWriter(
+            filename='cdiscount_import.xlsm',
+            error_filename='cdiscount_errors.xlsm', base_path=base_path)
+
+        plenty_fetch.connect()
+        plenty_fetch.extract_data()
+        plenty_fetch.get_texts()
+        variations = plenty_fetch.variations
+        if sort_by_family:
+            sorter = FamilySorter()
+            variations = sorter.sort(variations=variations)
+            plenty_fetch.errors += sorter.errors
+        cdiscount_writer.write_xlsx(variations=variations)
+        index.update(seller_refs=[row[ID_INDEX] for row in variations])
+        cdiscount_writer.write_error(errors=plenty_fetch.errors)
+    finally:
+        index.close()
@@ -0,0 +1,341 @@
+# pylint: disable=redefined-outer-name,unused-variable,expression-not-assigned
+
+import configparser
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from cdiscount_import import cli
+from cdiscount_import.cli import (FamilySorter, MAX_RETRIES, MIN_RETRY_DELAY,
+                                  PlentyFetch, RateLimiter, UniquenessIndex,
+                                  is_valid_ean13, split_pages)
+
+
+def response(status_code: int = 200, calls_left: str = None,
+             decay: str = None):
+    headers = {}
+    if calls_left is not None:
+        headers['X-Plenty-Global-Short-Period-Calls-Left'] = calls_left
+    if decay is not None:
+        headers['X-Plenty-Global-Short-Period-Decay'] = decay
+    return SimpleNamespace(status_code=status_code, headers=headers)
+
+
+def page_response(page: int, last_page: int, status_code: int = 200):
+    return SimpleNamespace(
+        status_code=status_code, ok=status_code < 400, headers={},
+        text='', json=lambda: {
+            'entries': [{'id': page}], 'lastPageNumber': last_page
+        }
+    )
+
+
+def variation(seller_ref: str, barcode: str, parent_sku: str) -> list:
+    return [
+        seller_ref, barcode, 'brand', 'Variant', 'category', 'short label',
+        'long label', 'short description', 'image 1', parent_sku, 'M', 'red',
+        'long description', 'image 2'
+    ]
+
+
+def export(index: UniquenessIndex, barcode: str, seller_ref: str,
+           parent_sku: str, item_id: str) -> None:
+    index.stage(barcode=barcode, seller_ref=seller_ref,
+                parent_sku=parent_sku, item_id=item_id)
+    index.update(seller_refs=[seller_ref])
+
+
+def describe_split_pages():
+
+    def it_returns_no_ranges_for_a_single_page(expect):
+        expect(split_pages(last_page=1, shards=4)) == []
+
+    def it_splits_the_pages_after_the_first_page(expect):
+        expect(split_pages(last_page=10, shards=3)) == [
+            range(2, 5), range(5, 8), range(8, 11)
+        ]
+
+    def it_covers_every_page_exactly_once(expect):
+        ranges = split_pages(last_page=23, shards=4)
+        expect([page for pages in ranges for page in pages]) == \
+            list(range(2, 24))
+
+    def it_limits_the_shards_to_the_amount_of_pages(expect):
+        expect(split_pages(last_page=3, shards=8)) == [range(2, 3),
+                                                       range(3, 4)]
+
+    def it_uses_one_range_for_less_than_one_shard(expect):
+        expect(split_pages(last_page=5, shards=0)) == [range(2, 6)]
+
+
+def fetch_variations(fetch: PlentyFetch) -> list:
+    return fetch._PlentyFetch__get_variations(  # pylint: disable=protected-access
+        refine={'referrerId': 3}, additional=['item'], lang='fr')
+
+
+def describe_sharded_variations():
+
+    @pytest.fixture
+    def fetch(monkeypatch):
+        monkeypatch.setattr(RateLimiter, 'wait', lambda self: None)
+        config = configparser.ConfigParser()
+        config.read_dict({
+            'plenty': {
+                'base_url': 'https://plenty.test', 'color_attribute_id': '1',
+                'size_attribute_id': '2', 'referrer_id': '3',
+                'ean_barcode_id': '4', 'plenty_id': '5',
+                'variation_shards': '3', 'variation_workers': '3'
+            }, 'category_mapping': {}
+        })
+        fetch = PlentyFetch(config=config)
+        fetch.api = SimpleNamespace(url='https://plenty.test', creds={})
+        return fetch
+
+    def it_keeps_the_page_order_across_shards(expect, fetch, monkeypatch):
+        def get(url, headers, params, timeout):
+            # Later pages answer faster, to finish the shards out of order
+            time.sleep((10 - params['page']) / 200)
+            return page_response(page=params['page'], last_page=10)
+        monkeypatch.setattr(cli.requests, 'get', get)
+
+        expect([entry['id'] for entry in fetch_variations(fetch)]) == \
+            list(range(1, 11))
+
+    def it_gives_up_after_the_maximum_retries(expect, fetch, monkeypatch):
+        calls = []
+        def get(url, headers, params, timeout):
+            calls.append(params['page'])
+            return page_response(page=params['page'], last_page=1,
+                                 status_code=429)
+        monkeypatch.setattr(cli.requests, 'get', get)
+
+        with pytest.raises(RuntimeError):
+            fetch_variations(fetch)
+        expect(len(calls)) == MAX_RETRIES + 1
+
+    def it_raises_on_a_failed_response(expect, fetch, monkeypatch):
+        def get(url, headers, params, timeout):
+            status_code = 500 if params['page'] == 4 else 200
+            return page_response(page=params['page'], last_page=10,
+                                 status_code=status_code)
+        monkeypatch.setattr(cli.requests, 'get', get)
+
+        with pytest.raises(RuntimeError):
+            fetch_variations(fetch)
+
+    def it_stops_the_other_shards_after_a_failure(expect, fetch,
+                                                  monkeypatch):
+        fetch.config['plenty']['variation_workers'] = '1'
+        calls = []
+        def get(url, headers, params, timeout):
+            calls.append(params['page'])
+            status_code = 500 if params['page'] == 2 else 200
+            return page_response(page=params['page'], last_page=10,
+                                 status_code=status_code)
+        monkeypatch.setattr(cli.requests, 'get', get)
+
+        with pytest.raises(RuntimeError):
+            fetch_variations(fetch)
+        expect(calls) == [1, 2]
+
+
+def describe_rate_limiter():
+
+    @pytest.fixture
+    def limiter():
+        return RateLimiter()
+
+    def it_ignores_responses_with_enough_calls_left(expect, limiter):
+        limiter.update(response=response(calls_left='20', decay='3'))
+        expect(limiter.resume_at) == 0.0
+
+    def it_ignores_responses_without_headers(expect, limiter):
+        limiter.update(response=response())
+        expect(limiter.resume_at) == 0.0
+
+    def it_pauses_when_the_calls_are_depleted(expect, limiter):
+        limiter.update(response=response(calls_left='1', decay='3'))
+        expect(limiter.resume_at - time.monotonic()) > 2
+
+    def it_waits_at_least_the_minimum_delay_on_429(expect, limiter):
+        limiter.update(response=response(status_code=429, calls_left='0',
+                                         decay='0'))
+        expect(limiter.resume_at - time.monotonic()) > MIN_RETRY_DELAY - 0.5
+
+    def it_backs_off_with_every_attempt(expect, limiter):
+        limiter.update(response=response(status_code=429), attempt=3)
+        expect(limiter.resume_at - time.monotonic()) > \
+            MIN_RETRY_DELAY * 8 - 0.5
+
+    def it_never_shortens_a_running_pause(expect, limiter):
+        limiter.pause(seconds=10)
+        limiter.update(response=response(calls_left='0', decay='1'))
+        expect(limiter.resume_at - time.monotonic()) > 9
+
+
+def describe_family_sorter():
+
+    @pytest.fixture
+    def sorter():
+        return FamilySorter()
+
+    def it_groups_by_parent_sku_and_seller_ref(expect, sorter):
+        rows = sorter.sort(variations=[
+            variation('10', '111', 'B'), variation('9', '222', 'A'),
+            variation('11', '333', 'A'), variation('2', '444', 'B')
+        ])
+        expect([(row[9], row[0]) for row in rows]) == [
+            ('A', '9'), ('A', '11'), ('B', '2'), ('B', '10')
+        ]
+
+    def it_keeps_the_first_variation_of_a_barcode(expect, sorter):
+        rows = sorter.sort(variations=[
+            variation('9', '111', 'A'), variation('10', '111', 'A')
+        ])
+        expect([row[0] for row in rows]) == ['9']
+        expect([row[0] for row in sorter.errors]) == ['10']
+
+    def it_drops_repeated_seller_refs(expect, sorter):
+        rows = sorter.sort(variations=[
+            variation('9', '111', 'A'), variation('9', '111', 'A')
+        ])
+        expect(len(rows)) == 1
+        expect(sorter.errors) == []
+
+    def it_maps_duplicates_to_the_error_columns(expect, sorter):
+        sorter.sort(variations=[
+            variation('9', '111', 'A'), variation('10', '111', 'A')
+        ])
+        expect(sorter.errors) == [[
+            '10', '111', 'brand', 'Variant', 'category', 'image 1', 'A', 'M',
+            'red', 'image 2', '', '', 'short label', 'long label',
+            'short description', 'long description'
+        ]]
+
+    def it_moves_rows_without_texts_to_the_errors(expect, sorter):
+        row = ['9', '111', 'brand', 'Variant', 'category', 'image 1', 'A',
+               'M', 'red']
+        expect(sorter.sort(variations=[row])) == []
+        expect(sorter.errors) == [row]
+
+
+def describe_is_valid_ean13():
+
+    def it_accepts_a_valid_check_digit(expect):
+        expect(is_valid_ean13(code='4006381333931')) == True
+
+    def it_accepts_a_check_digit_of_zero(expect):
+        expect(is_valid_ean13(code='9780201379600')) == True
+
+    def it_rejects_a_wrong_check_digit(expect):
+        expect(is_valid_ean13(code='4006381333932')) == False
+
+    def it_rejects_non_digits(expect):
+        expect(is_valid_ean13(code='40063813339X1')) == False
+
+    def it_rejects_a_wrong_length(expect):
+        expect(is_valid_ean13(code='400638133393')) == False
+
+
+def describe_uniqueness_index():
+
+    @pytest.fixture
+    def path(tmp_path):
+        return tmp_path / 'index.db'
+
+    @pytest.fixture
+    def open_run(path):
+        indexes = []
+        def open_run(*variations):
+            index = UniquenessIndex(path=path)
+            indexes.append(index)
+            for barcode, seller_ref, parent_sku, item_id in variations:
+                index.stage(barcode=barcode, seller_ref=seller_ref,
+                            parent_sku=parent_sku, item_id=item_id)
+            return index
+        yield open_run
+        for index in indexes:
+            index.close()
+
+    def it_accepts_new_values(expect, open_run):
+        index = open_run(('111', '1', 'P', '10'))
+        expect(index.check(barcode='111', seller_ref='1', parent_sku='P',
+                           item_id='10')) == ('111', 'P')
+
+    def it_flags_barcodes_of_other_variations_in_the_run(expect, open_run):
+        index = open_run(('111', '1', 'P', '10'), ('111', '2', 'P', '10'))
+        expect(index.check(barcode='111', seller_ref='2', parent_sku='P',
+                           item_id='10')) == ('Barcode used by 1', 'P')
+
+    def it_flags_conflicts_with_previous_exports(expect, open_run):
+        export(open_run(), '111', '1', 'P', '10')
+        index = open_run(('111', '1', 'P', '10'), ('111', '2', 'P', '20'))
+        expect(index.check(barcode='111', seller_ref='2', parent_sku='P',
+                           item_id='20')) == (
+            'Barcode used by 1', 'Parent SKU used by item 10')
+
+    def it_keeps_the_barcode_of_the_previous_owner(expect, open_run):
+        export(open_run(), '111', '1', 'P', '10')
+        index = open_run(('111', '2', 'P', '10'), ('111', '1', 'P', '10'))
+        expect(index.check(barcode='111', seller_ref='1', parent_sku='P',
+                           item_id='10')) == ('111', 'P')
+        expect(index.check(barcode='111', seller_ref='2', parent_sku='P',
+                           item_id='10')) == ('Barcode used by 1', 'P')
+
+    def it_accepts_swapped_barcodes(expect, open_run):
+        export(open_run(), '111', '1', 'P', '10')
+        export(open_run(), '222', '2', 'P', '10')
+        index = open_run(('222', '1', 'P', '10'), ('111', '2', 'P', '10'))
+        expect(index.check(barcode='222', seller_ref='1', parent_sku='P',
+                           item_id='10')) == ('222', 'P')
+        expect(index.check(barcode='111', seller_ref='2', parent_sku='P',
+                           item_id='10')) == ('111', 'P')
+
+    def it_accepts_a_barcode_that_moved_to_an_earlier_variation(
+            expect, open_run):
+        export(open_run(), '111', '5', 'P', '10')
+        index = open_run(('111', '3', 'P', '10'), ('333', '5', 'P', '10'))
+        expect(index.check(barcode='111', seller_ref='3', parent_sku='P',
+                           item_id='10')) == ('111', 'P')
+
+    def it_flags_barcodes_of_variations_missing_in_the_run(expect,
+                                                           open_run):
+        export(open_run(), '111', '1', 'P', '10')
+        index = open_run(('111', '2', 'Q', '20'))
+        expect(index.check(barcode='111', seller_ref='2', parent_sku='Q',
+                           item_id='20')) == ('Barcode used by 1', 'Q')
+
+    def it_only_records_exported_variations(expect, open_run):
+        index = open_run(('111', '1', 'P', '10'))
+        index.update(seller_refs=[])
+        expect(open_run().barcode_owner(barcode='111')) == ''
+
+    def it_replaces_the_barcode_of_an_exported_seller_ref(expect, open_run):
+        export(open_run(), '111', '1', 'P', '10')
+        export(open_run(), '222', '1', 'P', '10')
+        index = open_run()
+        expect(index.barcode_owner(barcode='111')) == ''
+        expect(index.barcode_owner(barcode='222')) == '1'
+
+    def it_replaces_the_parent_sku_of_an_exported_item(expect, open_run):
+        export(open_run(), '111', '1', 'P', '10')
+        export(open_run(), '111', '1', 'Q', '10')
+        index = open_run()
+        expect(index.parent_owner(parent_sku='P')) == ''
+        expect(index.parent_owner(parent_sku='Q')) == '10'
+
+    def it_releases_entries(expect, open_run):
+        index = open_run()
+        export(index, '111', '1', 'P', '10')
+        expect(index.release(value='111')) == 1
+        expect(index.release(value='P')) == 1
+        expect(open_run().check(barcode='111', seller_ref='2',
+                                parent_sku='P', item_id='20')) == \
+            ('111', 'P')
+
+    def it_resets_all_entries(expect, open_run):
+        index = open_run()
+        export(index, '111', '1', 'P', '10')
+        index.reset()
+        expect(open_run().barcode_owner(barcode='111')) == ''